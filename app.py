@@ -6,15 +6,126 @@ Text2SQL Desktop App - Interface completa com aba do schema
 import sys
 import time
 import os
+import csv
+import functools
+import importlib
+import json
+import numbers
+import re
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, deque, namedtuple
 from PyQt5.QtWidgets import *
 from PyQt5.QtCore import *
 from PyQt5.QtGui import *
-import pandas as pd
-from text2sql import Text2SQLConverter, connect_db, get_schema, execute_query
-from dotenv import load_dotenv
 
-# Carrega variáveis do .env
-load_dotenv()
+# text2sql (Gemini + SQLAlchemy) e dotenv são importados sob demanda; pandas só em get_dataframe
+# para não atrasar a primeira pintura da janela
+
+# Configurações da interface
+SETTINGS = {
+    'chunksize': 1000,
+}
+
+# Exemplos da barra lateral com o SQL já traduzido
+EXAMPLES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'examples.json')
+
+def load_examples():
+    try:
+        with open(EXAMPLES_PATH, encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"Erro ao carregar exemplos: {e}")
+        return []
+
+# Folhas de estilo
+SCHEMA_TITLE_STYLE = "font-size: 16px; font-weight: bold; margin: 10px;"
+SQL_DISPLAY_STYLE = "background-color: #2d3748; color: #e2e8f0; font-family: 'Courier New';"
+
+# Quantidade de consultas mantidas no histórico da sessão
+HISTORY_SIZE = 200
+HistoryEntry = namedtuple('HistoryEntry', 'nl sql time')
+
+# Entrada que já é SQL (somente leitura) é executada sem chamar o Gemini; exige FROM e ';' final
+# para não confundir perguntas em inglês ("Select the names...", "With the highest...") com SQL
+DIRECT_SQL_RE = re.compile(r'^\s*(?:SELECT|WITH)\b.*\bFROM\b.*;\s*$', re.I | re.S)
+MIN_QUESTION_TOKENS = 3
+MAX_PARALLEL_SUBQUERIES = 4
+# Acima disso a coluna é tratada como de alta cardinalidade (nomes, ids) e deixa de ser compartilhada
+SHARE_STRINGS_MAX = 1000
+# Tempo máximo (ms) que o fechamento da janela espera por cada thread em segundo plano
+SHUTDOWN_WAIT_MS = 2000
+
+# Todos os padrões de saneamento da pergunta numa única regex (uma passada sobre o texto)
+SANITIZE_RE = re.compile(
+    r"(?P<fence>```\w*)"
+    r"|(?P<comment>--[^\n]*)"
+    r"|(?P<ddl>\b(?:DROP|TRUNCATE|ALTER)\s+TABLE\b)"
+    r"|(?P<secret>AIza[0-9A-Za-z_\-]{35})",
+    re.I
+)
+
+def sanitize_nl(text):
+    """Remove cercas de código e comentários, mascara chaves de API e detecta DDL destrutivo"""
+    found = set()
+
+    def replace(match):
+        kind = match.lastgroup
+        found.add(kind)
+        if kind == 'secret':
+            return '[REDACTED]'
+        if kind == 'ddl':
+            return match.group(0)
+        return ''
+
+    return SANITIZE_RE.sub(replace, text).strip(), found
+
+def check_sql_syntax(sql):
+    """Checagem rápida de SQL digitado: parênteses e aspas balanceados e uma única instrução"""
+    from text2sql import statement_end
+    depth = 0
+    quote = None
+    i, n = 0, len(sql)
+    while i < n:
+        ch = sql[i]
+        if quote:
+            if ch == quote:
+                quote = None
+        elif ch in "'\"":
+            quote = ch
+        elif ch == '-' and sql.startswith('--', i):
+            # comentário até o fim da linha: aspas e parênteses ali não contam
+            end = sql.find('\n', i)
+            i = n if end < 0 else end
+            continue
+        elif ch == '(':
+            depth += 1
+        elif ch == ')':
+            depth -= 1
+            if depth < 0:
+                return "parêntese ')' sem abertura"
+        i += 1
+    if quote == "'":
+        return "aspas simples não fechadas"
+    if quote:
+        return "aspas duplas não fechadas"
+    if depth:
+        return "parêntese '(' não fechado"
+    # "SELECT ...; DROP ..." seria executado inteiro pelo libpq
+    if statement_end(sql) != len(sql.rstrip()) - 1:
+        return "apenas uma instrução por vez (';' só no final)"
+    return None
+
+@functools.lru_cache(maxsize=None)
+def load_env():
+    """Carrega variáveis do .env uma única vez"""
+    from dotenv import load_dotenv
+    load_dotenv()
+    SETTINGS['chunksize'] = int(os.getenv('RESULT_CHUNKSIZE', SETTINGS['chunksize']))
+
+def warm_up_imports():
+    """Importa os módulos pesados em segundo plano enquanto a janela é exibida"""
+    importlib.import_module('text2sql')
 
 # Fallback para schema de exemplo
 
@@ -33,43 +144,435 @@ def get_sample_schema():
     }
     return schema, schema_details
 
-class QueryWorker(QThread):
-    """Worker thread para executar queries"""
-    query_generated = pyqtSignal(str, float)
-    query_executed = pyqtSignal(object, object, float)
-    error_occurred = pyqtSignal(str)
+def share_strings(rows, seen):
+    """Faz valores de texto repetidos numa coluna (departamentos, códigos) apontarem para a mesma string"""
+    out = []
+    for row in rows:
+        out.append(tuple(v if type(v) is not str or seen[i] is None else seen[i].setdefault(v, v)
+                         for i, v in enumerate(row)))
+    # colunas com muitos valores distintos ganhariam pouco e manteriam todos os valores vivos
+    for i, values in enumerate(seen):
+        if values is not None and len(values) > SHARE_STRINGS_MAX:
+            seen[i] = None
+    return out
+
+class PersistentQueryWorker(QThread):
+    """Worker thread único que processa as consultas de uma fila"""
+    # todos os sinais levam o id do job: a interface ignora os de consultas já substituídas
+    query_generated = pyqtSignal(int, str, float)
+    columns_ready = pyqtSignal(int, list)
+    chunk_ready = pyqtSignal(int, list)
+    query_finished = pyqtSignal(int, int, float)
+    error_occurred = pyqtSignal(int, str)
+    job_finished = pyqtSignal(int)
 
-    def __init__(self, converter, nl_query, schema, engine):
+    def __init__(self, converter=None, engine=None, cache=None):
         super().__init__()
         self.converter = converter
-        self.nl_query = nl_query
-        self.schema = schema[0] if isinstance(schema, tuple) else schema
         self.engine = engine
+        self.cache = cache
+        self._queue = queue.Queue()
+        self._latest_id = 0
+
+    def submit(self, nl_query, schema, schema_prompt=None, direct_sql=False, schema_hash=None):
+        """Enfileira uma consulta; qualquer consulta anterior ainda pendente passa a ser descartada"""
+        self._latest_id += 1
+        self._queue.put((self._latest_id, nl_query, schema, schema_prompt, direct_sql, schema_hash))
+        return self._latest_id
+
+    def is_stale(self, job_id):
+        return job_id != self._latest_id
+
+    def stop(self, msecs=SHUTDOWN_WAIT_MS):
+        # o job em andamento vira obsoleto e para no próximo bloco em vez de ir até o fim
+        self._latest_id += 1
+        self._queue.put(None)
+        return self.wait(msecs)
 
     def run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            job_id = job[0]
+            if self.is_stale(job_id):
+                continue
+            self.process(*job)
+            if not self.is_stale(job_id):
+                self.job_finished.emit(job_id)
+
+    def process(self, job_id, nl_query, schema, schema_prompt, direct_sql=False, schema_hash=None):
+        from text2sql import schema_digest
+        translations = []
         try:
             start_time = time.time()
-            sql_query = self.converter.nl_to_sql(self.nl_query, self.schema)
+            if direct_sql:
+                sub_queries = sqls = [nl_query]
+            else:
+                schema_hash = schema_hash or schema_digest(schema).hex()
+                sub_queries = self.converter.decompose(nl_query)
+
+                def translate(question):
+                    return self.translate(question, schema, schema_prompt, schema_hash)
+
+                if len(sub_queries) > 1:
+                    # sub-perguntas independentes são traduzidas em paralelo
+                    try:
+                        with ThreadPoolExecutor(max_workers=min(len(sub_queries), MAX_PARALLEL_SUBQUERIES)) as pool:
+                            translations = list(pool.map(translate, sub_queries))
+                    except Exception as e:
+                        # alguma parte não se traduz sozinha: volta para a pergunta original inteira
+                        print(f"Divisão da pergunta falhou, traduzindo inteira: {e}")
+                        sub_queries = [nl_query]
+                if not translations:
+                    translations = [translate(nl_query)]
+                sqls = [sql for sql, _ in translations]
             generation_time = time.time() - start_time
-            self.query_generated.emit(sql_query, generation_time)
+            if self.is_stale(job_id):
+                return
+            self.query_generated.emit(job_id, "\n".join(sqls), generation_time)
 
             execution_start = time.time()
-            columns, rows = execute_query(self.engine, sql_query)
+            if len(sqls) == 1:
+                total = self.stream_results(job_id, sqls[0])
+            else:
+                total = self.merge_results(job_id, sub_queries, sqls)
+            if total is None:
+                return
             execution_time = time.time() - execution_start
-            self.query_executed.emit(columns, rows, execution_time)
+            self.remember(sub_queries, translations, schema_hash, succeeded=True)
+            self.query_finished.emit(job_id, total, execution_time)
+        except Exception as e:
+            self.remember(sub_queries, translations, schema_hash, succeeded=False)
+            if not self.is_stale(job_id):
+                self.error_occurred.emit(job_id, str(e))
+
+    def translate(self, nl_query, schema, schema_prompt, schema_hash):
+        """Retorna (sql, veio_do_cache)"""
+        sql_query = self.cache.get(nl_query, schema_hash) if self.cache else None
+        if sql_query is not None:
+            return sql_query, True
+        return self.converter.nl_to_sql(nl_query, schema, schema_prompt=schema_prompt), False
+
+    def remember(self, sub_queries, translations, schema_hash, succeeded):
+        """Só SQL que rodou no banco entra no cache; SQL em cache que falhou sai dele"""
+        if not self.cache:
+            return
+        for question, (sql_query, cached) in zip(sub_queries, translations):
+            if succeeded and not cached:
+                self.cache.set(question, schema_hash, sql_query)
+            elif not succeeded and cached:
+                self.cache.delete(question, schema_hash)
+
+    def stream_results(self, job_id, sql_query):
+        """Envia o resultado em lotes; retorna o total de linhas ou None se a consulta ficou obsoleta"""
+        from text2sql import execute_query_chunks
+        total = 0
+        seen = None
+        for columns, chunk in execute_query_chunks(self.engine, sql_query, SETTINGS['chunksize'], readonly=True):
+            if self.is_stale(job_id):
+                return None
+            if total == 0:
+                self.columns_ready.emit(job_id, columns)
+                seen = [{} for _ in columns]
+            if chunk:
+                self.chunk_ready.emit(job_id, share_strings(chunk, seen))
+                total += len(chunk)
+        return total
+
+    def merge_results(self, job_id, sub_queries, sqls):
+        """Une os resultados das sub-perguntas numa tabela só, identificando a origem de cada linha"""
+        from text2sql import execute_queries
+        results = []
+        for result in execute_queries(self.engine, sqls):
+            if self.is_stale(job_id):
+                return None
+            results.append(result)
+        # coluna identificada por (nome, ocorrência): "s.name, i.name" vira duas colunas name
+        keys = [(None, 0)]  # coluna da pergunta, sem colidir com uma coluna chamada "pergunta"
+        for cols, _ in results:
+            keys += [k for k in self._column_keys(cols) if k not in keys]
+        slot = {k: i for i, k in enumerate(keys)}
+        columns = ['pergunta' if name is None else name for name, _ in keys]
+        self.columns_ready.emit(job_id, columns)
+        total = 0
+        for question, (cols, rows) in zip(sub_queries, results):
+            positions = [slot[k] for k in self._column_keys(cols)]
+            merged = []
+            for row in rows:
+                out = [None] * len(columns)
+                out[0] = question
+                for pos, value in zip(positions, row):
+                    out[pos] = value
+                merged.append(tuple(out))
+            if merged:
+                self.chunk_ready.emit(job_id, merged)
+                total += len(merged)
+        return total
+
+    @staticmethod
+    def _column_keys(cols):
+        seen = {}
+        keys = []
+        for c in cols:
+            keys.append((c, seen.get(c, 0)))
+            seen[c] = seen.get(c, 0) + 1
+        return keys
+
+class ConverterLoader(QThread):
+    """Worker thread que carrega o .env e cria o conversor Gemini e o cache de SQL"""
+    converter_ready = pyqtSignal(object, object)
+    error_occurred = pyqtSignal(str)
+
+    def run(self):
+        try:
+            load_env()
+            from text2sql import Text2SQLConverter, SQLCache
+            sql_cache = SQLCache() if os.getenv('ENABLE_CACHE', 'true').lower() == 'true' else None
+            # a GUI usa só o SQLCache (que respeita ENABLE_CACHE); o LRU do conversor fica em memória
+            converter = Text2SQLConverter(persist_cache=False)
         except Exception as e:
             self.error_occurred.emit(str(e))
+            return
+        self.converter_ready.emit(converter, sql_cache)
+
+class SchemaRefreshWorker(QThread):
+    """Worker thread que confere a impressão digital do schema e só o relê se mudou"""
+    schema_ready = pyqtSignal(object)
+    error_occurred = pyqtSignal(str)
+
+    def __init__(self, engine, cached_fingerprint=None):
+        super().__init__()
+        self.engine = engine
+        self.cached_fingerprint = cached_fingerprint
+
+    def run(self):
+        from text2sql import get_schema, schema_fingerprint, save_cached_schema
+        try:
+            fingerprint = schema_fingerprint(self.engine)
+            if fingerprint == self.cached_fingerprint:
+                self.schema_ready.emit(None)
+                return
+            schema, schema_details = get_schema(self.engine)
+            save_cached_schema(self.engine, fingerprint, schema, schema_details)
+            self.schema_ready.emit((schema, schema_details))
+        except Exception as e:
+            self.error_occurred.emit(str(e))
+
+class CsvExportWorker(QThread):
+    """Worker thread para exportar resultados em CSV sem travar a interface"""
+    progress = pyqtSignal(int)
+    export_finished = pyqtSignal(str)
+    error_occurred = pyqtSignal(str)
+    PROGRESS_EVERY = 1000
+
+    def __init__(self, headers, rows, path):
+        super().__init__()
+        self.headers = headers
+        self.rows = rows
+        self.path = path
+
+    def run(self):
+        try:
+            with open(self.path, 'w', newline='', encoding='utf-8-sig', buffering=1 << 20) as f:
+                writer = csv.writer(f)
+                writer.writerow(self.headers)
+                for i, row in enumerate(self.rows, 1):
+                    writer.writerow(row)
+                    if i % self.PROGRESS_EVERY == 0:
+                        self.progress.emit(i)
+            self.progress.emit(len(self.rows))
+            self.export_finished.emit(self.path)
+        except Exception as e:
+            self.error_occurred.emit(str(e))
+
+# Papel customizado que devolve todos os dados de pintura de uma célula numa única chamada
+MULTIPLE_ROLES = Qt.UserRole + 1
+
+class ResultsModel(QAbstractTableModel):
+    """Modelo de resultados sobre as linhas cruas do banco; texto gerado só para células visíveis"""
+    def __init__(self, columns=None, rows=None):
+        super().__init__()
+        self._columns = list(columns or [])
+        self._rows = list(rows or [])
+        self._alignments = []
+        self._update_alignments()
+
+    def set_data(self, columns, rows):
+        self.beginResetModel()
+        self._columns = list(columns)
+        self._rows = list(rows)
+        self._alignments = []
+        self._update_alignments()
+        self.endResetModel()
+
+    def append_rows(self, rows):
+        if not rows:
+            return
+        start = len(self._rows)
+        self.beginInsertRows(QModelIndex(), start, start + len(rows) - 1)
+        self._rows.extend(rows)
+        self.endInsertRows()
+        if not self._alignments:
+            self._update_alignments()
+
+    def _update_alignments(self):
+        """Alinhamento por coluna, definido uma vez pelo tipo do primeiro valor"""
+        if not self._rows:
+            return
+        first = self._rows[0]
+        self._alignments = [
+            int(Qt.AlignRight | Qt.AlignVCenter) if isinstance(v, numbers.Number) and not isinstance(v, bool)
+            else int(Qt.AlignLeft | Qt.AlignVCenter)
+            for v in first
+        ]
+
+    def iter_rows(self):
+        return iter(self._rows)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._columns)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == MULTIPLE_ROLES:
+            return (str(self._rows[index.row()][index.column()]),
+                    self._alignments[index.column()] if self._alignments else int(Qt.AlignLeft | Qt.AlignVCenter))
+        if role == Qt.DisplayRole:
+            return str(self._rows[index.row()][index.column()])
+        if role == Qt.TextAlignmentRole and self._alignments:
+            return self._alignments[index.column()]
+        return None
 
-class ResultsTable(QTableWidget):
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            return str(self._columns[section])
+        return str(section + 1)
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        if not self._rows:
+            return
+        reverse = order == Qt.DescendingOrder
+        self.layoutAboutToBeChanged.emit()
+        try:
+            self._rows.sort(key=lambda r: (r[column] is None, r[column]), reverse=reverse)
+        except TypeError:
+            # tipos misturados na coluna: ordena pela representação textual
+            self._rows.sort(key=lambda r: str(r[column]), reverse=reverse)
+        self.layoutChanged.emit()
+
+class SpeedUpDelegate(QStyledItemDelegate):
+    """Delegate que lê texto e alinhamento com uma chamada a data() e guarda as células recentes"""
+    CACHE_SIZE = 512
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._cache = OrderedDict()
+
+    def clear_cache(self):
+        self._cache.clear()
+
+    def initStyleOption(self, option, index):
+        key = (index.row(), index.column())
+        roles = self._cache.get(key)
+        if roles is None:
+            roles = index.data(MULTIPLE_ROLES)
+            self._cache[key] = roles
+            if len(self._cache) > self.CACHE_SIZE:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(key)
+        text, alignment = roles
+        option.index = index
+        option.features |= QStyleOptionViewItem.HasDisplay
+        option.text = text
+        option.displayAlignment = Qt.Alignment(alignment)
+
+class ResultsTable(QTableView):
     """Tabela customizada para resultados"""
+    SIZE_HINT_ROWS = 200
+    MAX_COLUMN_WIDTH = 400
+    FLUSH_INTERVAL_MS = 50
+    FIRST_PAGE_ROWS = 200
+    FLUSH_BATCH_ROWS = 1000
+
     def __init__(self):
         super().__init__()
+        self._pending = deque()
+        self._flush_timer = QTimer(self)
+        self._flush_timer.setSingleShot(True)
+        self._flush_timer.timeout.connect(self.flush_rows)
+        self.setModel(ResultsModel())
+        self.delegate = SpeedUpDelegate(self)
+        self.setItemDelegate(self.delegate)
+        # linhas mudam de posição ao resetar/ordenar: o cache por (linha, coluna) deixa de valer
+        self.model().modelReset.connect(self.delegate.clear_cache)
+        self.model().layoutChanged.connect(self.delegate.clear_cache)
         self.setAlternatingRowColors(True)
         self.setSelectionBehavior(QAbstractItemView.SelectRows)
         self.setSortingEnabled(True)
+        header = self.horizontalHeader()
+        header.setSectionResizeMode(QHeaderView.Interactive)
+        header.setResizeContentsPrecision(self.SIZE_HINT_ROWS)
         self.setContextMenuPolicy(Qt.CustomContextMenu)
         self.customContextMenuRequested.connect(self.show_context_menu)
 
+    def set_results(self, columns, rows):
+        self._discard_pending()
+        self.model().set_data(columns, rows)
+        self.fit_columns()
+
+    def append_rows(self, rows):
+        """Acumula lotes recebidos; a primeira página aparece na hora, o resto a cada FLUSH_INTERVAL_MS"""
+        self._pending.extend(rows)
+        if self.model().rowCount() == 0:
+            self.flush_rows(self.FIRST_PAGE_ROWS)
+        elif not self._flush_timer.isActive():
+            self._flush_timer.start(self.FLUSH_INTERVAL_MS)
+
+    def flush_rows(self, limit=None):
+        """Insere até `limit` linhas pendentes e agenda o restante para a próxima volta do event loop"""
+        self._flush_timer.stop()
+        if not self._pending:
+            return
+        count = min(limit or self.FLUSH_BATCH_ROWS, len(self._pending))
+        rows = [self._pending.popleft() for _ in range(count)]
+        if self._pending:
+            self._flush_timer.start(0)
+        first_chunk = self.model().rowCount() == 0
+        # ordenação não é reativada aqui: setSortingEnabled(True) reordenaria tudo a cada lote
+        self.setUpdatesEnabled(False)
+        try:
+            self.model().append_rows(rows)
+            if first_chunk:
+                self.fit_columns()
+        finally:
+            self.setUpdatesEnabled(True)
+
+    def fit_columns(self):
+        """Largura das colunas medida com QFontMetrics sobre no máximo SIZE_HINT_ROWS linhas"""
+        model = self.model()
+        fm = self.fontMetrics()
+        sample = model._rows[:self.SIZE_HINT_ROWS]
+        for c, name in enumerate(model._columns):
+            w = max([fm.horizontalAdvance(str(name))] +
+                    [fm.horizontalAdvance(str(row[c])) for row in sample]) + 16
+            self.setColumnWidth(c, min(w, self.MAX_COLUMN_WIDTH))
+
+    def clear_results(self):
+        self._discard_pending()
+        self.model().set_data([], [])
+
+    def _discard_pending(self):
+        self._flush_timer.stop()
+        self._pending.clear()
+
     def show_context_menu(self, position):
         menu = QMenu(self)
         copy_action = menu.addAction("Copiar")
@@ -81,47 +584,62 @@ class ResultsTable(QTableWidget):
             self.export_to_csv()
 
     def copy_selection(self):
-        selection = self.selectedRanges()
-        if not selection:
+        selection = self.selectionModel().selection()
+        if selection.isEmpty():
             return
-        text = ""
-        for r in selection:
-            for row in range(r.topRow(), r.bottomRow()+1):
-                row_data = [self.item(row, col).text() if self.item(row, col) else "" \
-                            for col in range(r.leftColumn(), r.rightColumn()+1)]
-                text += "\t".join(row_data) + "\n"
-        QApplication.clipboard().setText(text)
+        rows = self.model()._rows
+        lines = ["\t".join(str(v) for v in rows[row][r.left():r.right()+1])
+                 for r in selection
+                 for row in range(r.top(), r.bottom()+1)]
+        QApplication.clipboard().setText("\n".join(lines) + "\n")
 
     def export_to_csv(self):
         filename, _ = QFileDialog.getSaveFileName(self, "Salvar CSV", \
                                                  f"query_result_{int(time.time())}.csv", \
                                                  "CSV Files (*.csv)")
         if filename:
-            df = self.get_dataframe()
-            df.to_csv(filename, index=False)
-            QMessageBox.information(self, "Sucesso", f"Dados exportados para {filename}")
+            model = self.model()
+            # cópia rasa: uma ordenação durante a exportação não afeta o arquivo
+            rows = list(model.iter_rows())
+            self._progress = QProgressDialog("Exportando CSV...", None, 0, max(len(rows), 1), self)
+            self._progress.setWindowModality(Qt.WindowModal)
+            self._export_worker = CsvExportWorker(list(model._columns), rows, filename)
+            self._export_worker.progress.connect(self._progress.setValue)
+            self._export_worker.export_finished.connect(self.on_export_finished)
+            self._export_worker.error_occurred.connect(self.on_export_error)
+            self._export_worker.start()
+
+    def on_export_finished(self, filename):
+        self._progress.close()
+        QMessageBox.information(self, "Sucesso", f"Dados exportados para {filename}")
+
+    def on_export_error(self, msg):
+        self._progress.close()
+        QMessageBox.critical(self, "Erro", f"Erro ao exportar: {msg}")
 
     def get_dataframe(self):
-        headers = [self.horizontalHeaderItem(i).text() for i in range(self.columnCount())]
-        data = [[self.item(r, c).text() if self.item(r, c) else "" \
-                for c in range(self.columnCount())] for r in range(self.rowCount())]
-        return pd.DataFrame(data, columns=headers)
+        import pandas as pd
+        model = self.model()
+        return pd.DataFrame(model._rows, columns=model._columns)
 
 class SchemaWidget(QWidget):
     """Widget para exibir o schema do banco"""
     def __init__(self):
         super().__init__()
+        # tabela -> (grupo, QTableWidget, colunas exibidas)
+        self._group_cache = {}
         self.setup_ui()
 
     def setup_ui(self):
         layout = QVBoxLayout()
         title = QLabel("Schema do Banco de Dados")
-        title.setStyleSheet("font-size: 16px; font-weight: bold; margin: 10px;")
+        title.setStyleSheet(SCHEMA_TITLE_STYLE)
         layout.addWidget(title)
 
         scroll = QScrollArea()
         container = QWidget()
         self.scroll_layout = QVBoxLayout()
+        self.scroll_layout.addStretch()
         container.setLayout(self.scroll_layout)
         scroll.setWidget(container)
         scroll.setWidgetResizable(True)
@@ -129,23 +647,53 @@ class SchemaWidget(QWidget):
         self.setLayout(layout)
 
     def update_schema(self, schema_details):
-        for i in reversed(range(self.scroll_layout.count())):
-            widget = self.scroll_layout.itemAt(i).widget()
-            if widget:
-                widget.setParent(None)
+        """Atualiza apenas as tabelas que mudaram, reaproveitando os widgets existentes"""
+        for table in set(self._group_cache) - set(schema_details):
+            group, _, _ = self._group_cache.pop(table)
+            self.scroll_layout.removeWidget(group)
+            group.deleteLater()
         for table, columns in schema_details.items():
-            group = QGroupBox(table.upper())
-            v = QVBoxLayout()
-            tbl = QTableWidget(len(columns), 2)
-            tbl.setHorizontalHeaderLabels(['Coluna', 'Tipo'])
-            for idx, (col, typ) in enumerate(columns):
-                tbl.setItem(idx, 0, QTableWidgetItem(col))
-                tbl.setItem(idx, 1, QTableWidgetItem(typ))
-            tbl.horizontalHeader().setStretchLastSection(True)
-            v.addWidget(tbl)
-            group.setLayout(v)
-            self.scroll_layout.addWidget(group)
-        self.scroll_layout.addStretch()
+            columns = tuple(tuple(c) for c in columns)
+            if table not in self._group_cache:
+                group, tbl = self.create_table_group(table)
+                self._group_cache[table] = (group, tbl, ())
+                # insere antes do stretch final
+                self.scroll_layout.insertWidget(self.scroll_layout.count() - 1, group)
+            group, tbl, old = self._group_cache[table]
+            if old != columns:
+                self.fill_table(tbl, old, columns)
+                self._group_cache[table] = (group, tbl, columns)
+
+    def create_table_group(self, table):
+        group = QGroupBox(table.upper())
+        v = QVBoxLayout()
+        tbl = QTableWidget(0, 2)
+        tbl.setHorizontalHeaderLabels(['Coluna', 'Tipo'])
+        tbl.horizontalHeader().setStretchLastSection(True)
+        v.addWidget(tbl)
+        group.setLayout(v)
+        return group, tbl
+
+    def fill_table(self, tbl, old, columns):
+        tbl.setRowCount(len(columns))
+        changed = [(idx, self._make_item(col), self._make_item(typ))
+                   for idx, (col, typ) in enumerate(columns)
+                   if idx >= len(old) or old[idx] != (col, typ)]
+        tbl.setUpdatesEnabled(False)
+        tbl.blockSignals(True)
+        try:
+            for idx, col_item, typ_item in changed:
+                tbl.setItem(idx, 0, col_item)
+                tbl.setItem(idx, 1, typ_item)
+        finally:
+            tbl.blockSignals(False)
+            tbl.setUpdatesEnabled(True)
+
+    @staticmethod
+    def _make_item(text):
+        item = QTableWidgetItem(text)
+        item.setFlags(Qt.ItemIsEnabled | Qt.ItemIsSelectable)
+        return item
 
 class MainWindow(QMainWindow):
     """Janela principal"""
@@ -154,13 +702,25 @@ class MainWindow(QMainWindow):
         self.engine = None
         self.schema = None
         self.schema_details = None
+        self.schema_prompt = None
+        self.schema_hash = None
+        self.current_job = 0
+        self._schema_built = False
         self.converter = None
-        self.query_history = []
+        self.sql_cache = None
+        self.schema_worker = None
+        self.converter_loader = None
+        self.query_history = deque(maxlen=HISTORY_SIZE)
+        self._history_ring = []
+        self.query_total = 0
         self.setup_ui()
         self.setup_menus()
         self.setup_status_bar()
-        self.connect_to_database()
-        self.auto_connect_gemini()
+        self.setup_worker()
+        # módulos pesados aquecem em paralelo; conexões só depois da primeira pintura
+        QThreadPool.globalInstance().start(warm_up_imports)
+        QTimer.singleShot(0, self.connect_to_database)
+        QTimer.singleShot(0, self.auto_connect_gemini)
 
     def setup_ui(self):
         self.setWindowTitle("Text2SQL - Google Gemini")
@@ -180,15 +740,10 @@ class MainWindow(QMainWindow):
         v = QVBoxLayout(widget)
         grp = QGroupBox("Exemplos")
         lv = QVBoxLayout()
-        exemplos = [
-            ("Média Economia 2010", "Qual é a média de notas dos cursos de Economia em 2010?"),
-            ("Contar Estudantes CS", "Quantos estudantes há em ciência da computação?"),
-            ("Maior Salário", "Quem tem o maior salário?"),
-            ("Todos os Estudantes", "Mostrar todos os estudantes"),
-            ("Listar Professores", "Listar todos os professores")
-        ]
-        for txt, qry in exemplos:
-            btn = QPushButton(txt)
+        self.examples = load_examples()
+        for example in self.examples:
+            btn = QPushButton(example['label'])
+            qry = example['nl']
             btn.clicked.connect(lambda _, q=qry: self.set_example_query(q))
             lv.addWidget(btn)
         grp.setLayout(lv)
@@ -226,7 +781,7 @@ class MainWindow(QMainWindow):
         self.sql_display = QTextEdit()
         self.sql_display.setReadOnly(True)
         self.sql_display.setMaximumHeight(100)
-        self.sql_display.setStyleSheet("background-color: #2d3748; color: #e2e8f0; font-family: 'Courier New';")
+        self.sql_display.setStyleSheet(SQL_DISPLAY_STYLE)
         sql_layout.addWidget(self.sql_display)
         sql_group.setLayout(sql_layout)
         rv.addWidget(sql_group)
@@ -246,10 +801,13 @@ class MainWindow(QMainWindow):
         # Histórico tab
         history_tab = QWidget()
         history_layout = QVBoxLayout(history_tab)
-        self.history_list = QListWidget()
+        self.history_model = QStringListModel()
+        self.history_list = QListView()
+        self.history_list.setModel(self.history_model)
         history_layout.addWidget(self.history_list)
         self.tab_widget.addTab(history_tab, "Histórico")
 
+        self.tab_widget.currentChanged.connect(self._on_tab_changed)
         v.addWidget(self.tab_widget)
         return widget
 
@@ -273,20 +831,132 @@ class MainWindow(QMainWindow):
         self.status_bar.addWidget(self.connection_label)
         self.status_bar.addPermanentWidget(self.query_count_label)
 
+    def setup_worker(self):
+        self.worker = PersistentQueryWorker()
+        self.worker.query_generated.connect(self.on_query_generated)
+        self.worker.columns_ready.connect(self.display_results)
+        self.worker.chunk_ready.connect(self.append_results)
+        self.worker.query_finished.connect(self.on_query_finished)
+        self.worker.error_occurred.connect(self.on_error)
+        self.worker.job_finished.connect(self.on_worker_finished)
+        self.worker.start()
+
+    def closeEvent(self, event):
+        self.worker.stop()
+        for thread in (self.schema_worker, self.converter_loader):
+            if thread is not None and thread.isRunning():
+                thread.wait(SHUTDOWN_WAIT_MS)
+        if self.converter:
+            # espera criações pendentes do context cache e o remove: não fica cobrando até o TTL
+            QThreadPool.globalInstance().waitForDone(SHUTDOWN_WAIT_MS)
+            self.converter.clear_context_cache()
+        super().closeEvent(event)
+
     def connect_to_database(self):
+        load_env()
+        from text2sql import connect_db, load_cached_schema
         try:
             self.engine = connect_db()
-            self.schema, self.schema_details = get_schema(self.engine)
-            self.connection_label.setText("PostgreSQL conectado")
         except Exception as e:
-            print(f"Erro DB: {e}")
-            self.schema, self.schema_details = get_sample_schema()
+            self.on_schema_error(str(e))
+            return
+        self.worker.engine = self.engine
+        # stale-while-revalidate: mostra o schema salvo e confere o banco em segundo plano
+        cached = load_cached_schema(self.engine)
+        fingerprint = None
+        if cached:
+            fingerprint, schema, schema_details = cached
+            self.apply_schema(schema, schema_details)
+            self.connection_label.setText("PostgreSQL (schema em cache)")
+        self.schema_worker = SchemaRefreshWorker(self.engine, fingerprint)
+        self.schema_worker.schema_ready.connect(self.on_schema_ready)
+        self.schema_worker.error_occurred.connect(self.on_schema_error)
+        self.schema_worker.start()
+
+    def on_schema_ready(self, result):
+        if result is not None:
+            self.apply_schema(*result)
+        self.connection_label.setText("PostgreSQL conectado")
+
+    def on_schema_error(self, msg):
+        print(f"Erro DB: {msg}")
+        if not self.schema:
+            self.apply_schema(*get_sample_schema())
             self.connection_label.setText("Usando schema de exemplo")
+
+    def apply_schema(self, schema, schema_details):
+        from text2sql import schema_digest
+        self.schema, self.schema_details = schema, schema_details
+        # hash do schema calculado uma vez aqui; o worker só hasheia a pergunta
+        self.schema_hash = schema_digest(schema).hex()
+        self.seed_example_cache()
+        # widgets do schema só são montados quando a aba é aberta
+        self._schema_built = False
+        if self.tab_widget.currentWidget() is self.schema_widget:
+            self.build_schema_tab()
+        self.refresh_context_cache()
+
+    def _on_tab_changed(self, index):
+        if self.tab_widget.widget(index) is self.schema_widget and not self._schema_built:
+            self.build_schema_tab()
+
+    def build_schema_tab(self):
         if self.schema_details:
             self.schema_widget.update_schema(self.schema_details)
+        self._schema_built = True
 
     def auto_connect_gemini(self):
-        self.converter = Text2SQLConverter()
+        # import do SDK, leitura do .env e configuração do Gemini acontecem fora da thread da interface
+        self.execute_btn.setEnabled(False)
+        self.execute_btn.setText("Conectando Gemini...")
+        self.converter_loader = ConverterLoader()
+        self.converter_loader.converter_ready.connect(self.on_converter_ready)
+        self.converter_loader.error_occurred.connect(self.on_converter_error)
+        self.converter_loader.start()
+
+    def on_converter_ready(self, converter, sql_cache):
+        self.converter = converter
+        self.sql_cache = sql_cache
+        self.execute_btn.setEnabled(True)
+        self.execute_btn.setText("Executar")
+        self.worker.converter = self.converter
+        self.worker.cache = self.sql_cache
+        self.seed_example_cache()
+        QTimer.singleShot(0, self.warmup_gemini)
+        self.refresh_context_cache()
+
+    def on_converter_error(self, msg):
+        # sem Gemini ainda dá para executar SQL digitado diretamente
+        print(f"Erro Gemini: {msg}")
+        self.execute_btn.setEnabled(True)
+        self.execute_btn.setText("Executar")
+        self.status_bar.showMessage(f"Gemini indisponível: {msg}")
+
+    def seed_example_cache(self):
+        """Coloca no cache o SQL pré-traduzido dos exemplos (escritos para o banco projeto_final),
+        se o schema tiver as tabelas e colunas usadas"""
+        if not self.sql_cache or not self.schema or not self.converter:
+            return
+        if self.converter.current_db != 'projeto_final':
+            return
+        from text2sql import TABLE_REF_RE
+        for example in self.examples:
+            tables = set(TABLE_REF_RE.findall(example['sql']))
+            if not tables <= set(self.schema):
+                continue
+            columns = example.get('columns', {})
+            if all(set(cols) <= set(self.schema.get(table, ())) for table, cols in columns.items()):
+                self.sql_cache.seed(example['nl'], self.schema_hash, example['sql'])
+
+    def warmup_gemini(self):
+        QThreadPool.globalInstance().start(self.converter.warmup)
+
+    def refresh_context_cache(self):
+        """Recria o prompt do schema e o context cache do Gemini sempre que o schema muda"""
+        if self.converter and self.schema:
+            self.schema_prompt = self.converter.prepare_schema(self.schema)
+            converter, schema = self.converter, self.schema
+            QThreadPool.globalInstance().start(lambda: converter.create_context_cache(schema))
 
     def set_example_query(self, query):
         self.query_input.setPlainText(query)
@@ -294,65 +964,87 @@ class MainWindow(QMainWindow):
     def clear_query(self):
         self.query_input.clear()
         self.sql_display.clear()
-        self.results_table.clear()
-        self.results_table.setRowCount(0)
-        self.results_table.setColumnCount(0)
+        self.results_table.clear_results()
 
     def execute_query(self):
+        # desabilitado só enquanto o Gemini carrega; uma nova consulta substitui a que estiver em andamento
+        if not self.execute_btn.isEnabled():
+            return
         if not self.schema:
             QMessageBox.warning(self, "Aviso", "Schema não disponível!")
             return
-        if not self.converter or not self.converter.use_gemini:
-            QMessageBox.warning(self, "Aviso", "Google Gemini não está configurado!")
-            return
         nl_query = self.query_input.toPlainText().strip()
         if not nl_query:
             QMessageBox.warning(self, "Aviso", "Digite uma pergunta!")
             return
+        # SQL digitado diretamente vai ao banco sem passar pelo Gemini
+        direct_sql = bool(DIRECT_SQL_RE.match(nl_query))
+        if direct_sql:
+            if 'ddl' in sanitize_nl(nl_query)[1]:
+                QMessageBox.warning(self, "Aviso", "Comandos destrutivos (DROP/TRUNCATE/ALTER) não são permitidos!")
+                return
+            error = check_sql_syntax(nl_query)
+            if error:
+                QMessageBox.warning(self, "Aviso", f"SQL inválido: {error}")
+                return
+        else:
+            if not self.converter or not self.converter.use_gemini:
+                QMessageBox.warning(self, "Aviso", "Google Gemini não está configurado!")
+                return
+            nl_query, found = sanitize_nl(nl_query)
+            if 'ddl' in found:
+                QMessageBox.warning(self, "Aviso", "Comandos destrutivos (DROP/TRUNCATE/ALTER) não são permitidos!")
+                return
+            if len(nl_query.split()) < MIN_QUESTION_TOKENS:
+                QMessageBox.warning(self, "Aviso", "Pergunta muito curta, descreva melhor o que deseja consultar!")
+                return
         self.clear_query()
-        self.execute_btn.setEnabled(False)
         self.execute_btn.setText("Processando...")
-        schema_for_worker = (self.schema, self.schema_details)
-        self.worker = QueryWorker(self.converter, nl_query, schema_for_worker, self.engine)
-        self.worker.query_generated.connect(self.on_query_generated)
-        self.worker.query_executed.connect(self.on_query_executed)
-        self.worker.error_occurred.connect(self.on_error)
-        self.worker.finished.connect(self.on_worker_finished)
-        self.worker.start()
+        self.current_job = self.worker.submit(nl_query, self.schema, self.schema_prompt, direct_sql, self.schema_hash)
 
-    def on_query_generated(self, sql_query, generation_time):
+    def on_query_generated(self, job_id, sql_query, generation_time):
+        if job_id != self.current_job:
+            return
         self.sql_display.setPlainText(sql_query)
         self.status_bar.showMessage(f"SQL gerado em {generation_time:.1f}s", 3000)
 
-    def on_query_executed(self, columns, rows, execution_time):
-        self.display_results(columns, rows)
+    def on_query_finished(self, job_id, row_count, execution_time):
+        if job_id != self.current_job:
+            return
+        self.results_table.flush_rows()
         self.add_to_history(self.query_input.toPlainText(), self.sql_display.toPlainText())
-        selfstatus = f"Executado em {execution_time:.2f}s - {len(rows)} resultados"
+        selfstatus = f"Executado em {execution_time:.2f}s - {row_count} resultados"
         self.status_bar.showMessage(selfstatus, 5000)
 
-    def display_results(self, columns, rows):
-        self.results_table.setRowCount(len(rows))
-        self.results_table.setColumnCount(len(columns))
-        self.results_table.setHorizontalHeaderLabels(list(columns))
-        for r_idx, row in enumerate(rows):
-            for c_idx, val in enumerate(row):
-                self.results_table.setItem(r_idx, c_idx, QTableWidgetItem(str(val)))
-        self.results_table.resizeColumnsToContents()
+    def display_results(self, job_id, columns):
+        if job_id != self.current_job:
+            return
+        self.results_table.set_results(columns, [])
         self.tab_widget.setCurrentIndex(0)
 
+    def append_results(self, job_id, rows):
+        if job_id != self.current_job:
+            return
+        self.results_table.append_rows(rows)
+
     def add_to_history(self, nl_query, sql_query):
         timestamp = time.strftime("%H:%M:%S")
         entry = f"[{timestamp}] {nl_query[:40]}{'...' if len(nl_query)>40 else ''}"
-        self.history_list.addItem(entry)
-        self.query_history.append({'nl': nl_query, 'sql': sql_query, 'time': timestamp})
-        self.query_count_label.setText(f"{len(self.query_history)} consultas")
+        self._history_ring.append(entry)
+        self._history_ring = self._history_ring[-HISTORY_SIZE:]
+        self.history_model.setStringList(self._history_ring)
+        self.query_history.append(HistoryEntry(nl_query, sql_query, timestamp))
+        self.query_total += 1
+        self.query_count_label.setText(f"{self.query_total} consultas")
 
-    def on_error(self, msg):
+    def on_error(self, job_id, msg):
+        if job_id != self.current_job:
+            return
         QMessageBox.critical(self, "Erro", f"Erro: {msg}")
 
-    def on_worker_finished(self):
-        self.execute_btn.setEnabled(True)
-        self.execute_btn.setText("Executar")
+    def on_worker_finished(self, job_id):
+        if job_id == self.current_job:
+            self.execute_btn.setText("Executar")
 
 
 def main():
@@ -5,12 +5,24 @@ Text2SQL com Google Gemini - Sistema simplificado
 
 import os
 import sqlalchemy
+from sqlalchemy.pool import QueuePool
 import google.generativeai as genai
 import hashlib
+import math
+import pickle
 import re
+import sqlite3
+import threading
 import time
+import unicodedata
+import uuid
+import zlib
+from collections import Counter, OrderedDict, defaultdict
+from pathlib import Path
 from dotenv import load_dotenv
 import argparse
+import asyncio
+import datetime
 
 load_dotenv()
 
@@ -23,20 +35,418 @@ DEFAULT_DB_CONFIG = {
     'database': os.getenv('DB_NAME', 'projeto_final'),
 }
 
+# Conectores que separam perguntas independentes numa mesma frase
+COMPOUND_SPLIT_RE = re.compile(r'\s*(?:;|\be\s+tamb[ée]m\b|\band\s+also\b)\s*', re.I)
+# Uma parte só é pergunta independente se começar como pergunta ou comando ("... e também suas notas" não é)
+STANDALONE_RE = re.compile(
+    r'^(?:qual|quais|quant[oa]s?|quem|onde|quando|como|liste|listar|mostre|mostrar|exiba|exibir'
+    r'|what|which|who|how|list|show)\b', re.I
+)
+
+# Início de cada resposta "N: SQL;" de nl_to_sql_batch (o SQL pode continuar nas linhas seguintes)
+BATCH_ITEM_RE = re.compile(r'^\s*(\d+)[:.]\s*', re.M)
+
+# Descrições das tabelas conhecidas usadas no prompt
+TABLE_DESCRIPTIONS = {
+    'student': ('Informações dos estudantes da universidade', [
+        'id (INTEGER, PRIMARY KEY)',
+        'name (VARCHAR)',
+        'dept_name (VARCHAR)',
+        'tot_cred (INTEGER)' ],
+        'Relaciona com department(dept_name), takes(id)'),
+    'instructor': ('Informações dos professores', [
+        'id (INTEGER, PRIMARY KEY)',
+        'name (VARCHAR)',
+        'dept_name (VARCHAR)',
+        'salary (NUMERIC)' ],
+        'Relaciona com department(dept_name)'),
+    'course': ('Catálogo de cursos ofertados', [
+        'course_id (VARCHAR, PRIMARY KEY)',
+        'title (VARCHAR)',
+        'dept_name (VARCHAR)',
+        'credits (INTEGER)' ],
+        'Relaciona com department(dept_name), takes(course_id)'),
+    'takes': ('Registro de matrículas e notas', [
+        'id (INTEGER)',
+        'course_id (VARCHAR)',
+        'sec_id (INTEGER)',
+        'semester (VARCHAR)',
+        'year (INTEGER)',
+        'grade (NUMERIC)' ],
+        'Relaciona student(id), course(course_id)'),
+    'department': ('Departamentos da universidade', [
+        'dept_name (VARCHAR, PRIMARY KEY)',
+        'building (VARCHAR)',
+        'budget (NUMERIC)' ],
+        'Relaciona student, instructor, course')
+}
+
+# Limpeza da resposta do Gemini: cercas markdown, linhas de comentário ou de explicação e espaços
+# (em linhas de explicação seguidas do SQL, como "Resultado: SELECT ...", só o prefixo sai)
+STRIP_RE = re.compile(
+    r'^\s*(?:(?:```|--|#).*'
+    r'|(?:explica[çc][ãa]o|resultado|esta consulta)\b(?:[\s:]*(?=(?:SELECT|WITH)\b)|.*))', re.I | re.M
+)
+WHITESPACE_RE = re.compile(r'\s+')
+DOUBLE_QUOTED_RE = re.compile(r'"([^"]+)"')
+
+# SQL aceito: SELECT (opcionalmente após um WITH) seguido de FROM, terminando em ';'
+VALID_SQL_RE = re.compile(r'(?:WITH\b.*?)?SELECT\b.*?\bFROM\b.*;$', re.I | re.S)
+
+# Prompts: parte fixa (instruções + schema) e pergunta, preenchidos com format_map
+DBA_PROMPT_TEMPLATE = """
+            Você é um DBA especialista em PostgreSQL. Abaixo há o esquema completo do banco, com tabelas e colunas.  
+            Converta a pergunta em linguagem natural para **uma única** consulta SQL válida, formatada com convenções rígidas:
+
+            • **Palavras-chave em MAIÚSCULAS**: SELECT, FROM, WHERE, JOIN, ON, GROUP BY, ORDER BY, LIMIT, etc.  
+            • **Espaço** antes e depois de cada palavra-chave.  
+            • **Quebras de linha** entre as principais cláusulas:  
+                SELECT …  
+                FROM …  
+                [JOIN … ON …]  
+                WHERE …  
+                [GROUP BY …]  
+                [ORDER BY …]  
+            • **Indentação** de 2 espaços em JOIN/ON.  
+            • Termine sempre com ponto-e-vírgula `;`  
+            • Não inclua nada além da consulta (sem explicações, sem markdown, sem comentários).
+
+            ESQUEMA DO BANCO:
+            {schema_text}
+
+            """
+
+PROJETO_FINAL_PROMPT_TEMPLATE = (
+    "Você é um especialista em SQL PostgreSQL. Converta esta pergunta em linguagem natural para uma consulta SQL válida e completa.\n\n"
+    "ESQUEMA DETALHADO DO BANCO DE DADOS:\n{schema_text}\n\n"
+    "EXEMPLOS DE CONSULTAS VÁLIDAS:\n{examples}\n"
+    "REGRAS OBRIGATÓRIAS:\n"
+    "1. SEMPRE inclua as cláusulas SELECT e FROM\n"
+    "2. Use JOINs quando necessário para conectar tabelas relacionadas\n"
+    "3. Para médias de notas: AVG(takes.grade) com JOIN entre takes e course\n"
+    "4. Para filtrar por departamento: WHERE course.dept_name = 'Nome_Dept'\n"
+    "5. Para filtrar por ano: WHERE takes.year = XXXX\n"
+    "6. Use aspas simples para strings: 'Finance', nunca \"Finance\"\n"
+    "7. Termine sempre com ponto e vírgula\n"
+    "8. Para contagens: COUNT(*) ou COUNT(DISTINCT coluna)\n"
+    "9. Para ordenação: ORDER BY coluna DESC/ASC quando apropriado\n"
+    "10. NUNCA retorne SQL incompleto ou fragmentado\n\n"
+)
+
+QUESTION_TEMPLATE = "PERGUNTA: {nl_query}\n"
+PROJETO_FINAL_QUESTION_TEMPLATE = (
+    "PERGUNTA: {nl_query}\n\n"
+    "Gere apenas o SQL completo e válido (sem explicações, markdown ou comentários):"
+)
+
+# Diretório dos caches locais (consultas e schema)
+CACHE_DIR = Path.home() / '.cache' / 'text2sql'
+
+def _normalize_nl(text: str) -> str:
+    """Normaliza a pergunta: minúsculas, sem acentos, pontuação e espaços extras"""
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return ' '.join(re.findall(r'\w+', text))
+
+# Nomes de departamento usados nas perguntas → dept_name no banco
+DEPT_MAP = {
+    'economia': 'Finance',
+    'economics': 'Finance',
+    'finance': 'Finance',
+    'ciência da computação': 'Comp. Sci.',
+    'ciencia da computacao': 'Comp. Sci.',
+    'computer science': 'Comp. Sci.',
+    'física': 'Physics',
+    'fisica': 'Physics',
+    'physics': 'Physics',
+    'matemática': 'Math',
+    'matematica': 'Math',
+    'mathematics': 'Math',
+}
+# Troca os nomes na pergunta antes do prompt, em vez de pedir o mapeamento ao modelo
+DEPT_RE = re.compile(r'\b(?:' + '|'.join(sorted(map(re.escape, DEPT_MAP), key=len, reverse=True)) + r')\b', re.I)
+_NORMALIZED_DEPTS = {_normalize_nl(name): dept for name, dept in DEPT_MAP.items()}
+_DEPT = '(' + '|'.join(sorted(map(re.escape, _NORMALIZED_DEPTS), key=len, reverse=True)) + ')'
+_COUNT_TABLES = {'estudantes': 'student', 'alunos': 'student', 'professores': 'instructor',
+                 'cursos': 'course', 'departamentos': 'department'}
+
+# Perguntas triviais do banco projeto_final traduzidas sem chamar o Gemini (casadas com a
+# pergunta normalizada inteira): (regex, colunas exigidas por tabela, gerador do SQL)
+SQL_TEMPLATES = [
+    (re.compile(rf'(?:qual (?:e )?a )?media (?:das |de )?notas (?:dos cursos )?(?:de|em) {_DEPT}(?: em (\d{{4}}))?'),
+     {'takes': ('course_id', 'grade', 'year'), 'course': ('course_id', 'dept_name')},
+     lambda m: ("SELECT AVG(t.grade) FROM takes t JOIN course c ON t.course_id=c.course_id "
+                f"WHERE c.dept_name='{_NORMALIZED_DEPTS[m.group(1)]}'"
+                + (f" AND t.year={m.group(2)}" if m.group(2) else "") + ";")),
+    (re.compile(rf'quantos (?:estudantes|alunos) (?:ha )?(?:em|de) {_DEPT}'),
+     {'student': ('dept_name',)},
+     lambda m: f"SELECT COUNT(*) FROM student WHERE dept_name='{_NORMALIZED_DEPTS[m.group(1)]}';"),
+    (re.compile(r'quantos (estudantes|alunos|professores|cursos|departamentos)(?: (?:ha|existem))?'),
+     {},
+     lambda m: f"SELECT COUNT(*) FROM {_COUNT_TABLES[m.group(1)]};"),
+    (re.compile(rf'(?:listar|mostrar) (?:os )?cursos (?:de|do departamento de) {_DEPT}'),
+     {'course': ('course_id', 'title', 'credits', 'dept_name')},
+     lambda m: f"SELECT course_id, title, credits FROM course WHERE dept_name='{_NORMALIZED_DEPTS[m.group(1)]}';"),
+]
+TABLE_REF_RE = re.compile(r'\b(?:FROM|JOIN)\s+(\w+)', re.I)
+
+# Palavras que não mudam o sentido da consulta: o nível semântico do cache só ignora estas
+STOPWORDS = frozenset(
+    'a o as os um uma de do da dos das em no na nos nas que qual quais e eh sao ha '
+    'me mostre mostrar liste listar exiba exibir todos todas '
+    'the an of in what which is are show list all please'.split()
+)
+
+def statement_end(text: str) -> int:
+    """Posição do primeiro ';' fora de strings ('...'), identificadores ("...") e comentários --, ou -1"""
+    quote = None
+    i, n = 0, len(text)
+    while i < n:
+        ch = text[i]
+        if quote:
+            if ch == quote:
+                quote = None
+        elif ch in "'\"":
+            quote = ch
+        elif ch == '-' and text.startswith('--', i):
+            end = text.find('\n', i)
+            if end < 0:
+                return -1
+            i = end
+        elif ch == ';':
+            return i
+        i += 1
+    return -1
+
+def schema_digest(schema: dict) -> bytes:
+    """Impressão digital (8 bytes) de um schema {tabela: colunas}, usada por todos os caches de SQL"""
+    return hashlib.blake2b(repr(sorted(schema.items())).encode(), digest_size=8).digest()
+
+class SQLCache:
+    """Cache de SQL gerado em dois níveis: chave exata (persistida em SQLite) e similaridade semântica"""
+
+    def __init__(self, path=None, similarity_threshold=None, ttl=None):
+        self.path = path or str(CACHE_DIR / 'query_cache.db')
+        threshold = similarity_threshold or os.getenv('CACHE_SIMILARITY')
+        # nível semântico desligado por padrão: só com CACHE_SIMILARITY configurado
+        self.similarity_threshold = float(threshold) if threshold else None
+        self.ttl = int(ttl or os.getenv('CACHE_TTL', 86400))
+        self.exact = {}
+        self._entries = {}
+        self._postings = defaultdict(set)
+        self._lock = threading.Lock()
+        self._db = None
+        self._load()
+
+    @classmethod
+    def make_key(cls, nl_query: str, schema_hash: str) -> str:
+        payload = _normalize_nl(nl_query) + '|' + schema_hash
+        return hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+
+    def _load(self):
+        try:
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS cache("
+                             "key TEXT PRIMARY KEY, sql TEXT, schema_hash TEXT, normalized TEXT, ts INTEGER)")
+            with self._db:
+                self._db.execute("DELETE FROM cache WHERE ts < ?", (int(time.time()) - self.ttl,))
+            rows = self._db.execute("SELECT key, sql, schema_hash, normalized, ts FROM cache WHERE ts >= ?",
+                                    (int(time.time()) - self.ttl,)).fetchall()
+            for key, *entry in rows:
+                self._index(key, *entry)
+        except Exception as e:
+            print(f"Erro ao carregar cache: {e}")
+
+    def _index(self, key, sql, schema_hash, normalized, ts):
+        if time.time() - ts > self.ttl:
+            return
+        tokens = Counter(normalized.split())
+        norm = math.sqrt(sum(v * v for v in tokens.values()))
+        self.exact[key] = sql
+        self._entries[key] = (schema_hash, tokens, norm, sql, ts)
+        for token in tokens:
+            self._postings[token].add(key)
+
+    def get(self, nl_query: str, schema_hash: str):
+        """schema_hash é schema_digest(schema).hex(), calculado uma vez por schema"""
+        key = self.make_key(nl_query, schema_hash)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and time.time() - entry[4] <= self.ttl:
+                return self.exact[key]
+            if self.similarity_threshold is None:
+                return None
+            return self._similar(_normalize_nl(nl_query), schema_hash)
+
+    def _similar(self, normalized: str, schema_hash: str):
+        tokens = Counter(normalized.split())
+        norm = math.sqrt(sum(v * v for v in tokens.values()))
+        if not norm:
+            return None
+        # números, departamentos, ordenação etc. precisam coincidir: a pergunta só pode
+        # diferir da armazenada em palavras de STOPWORDS
+        content = tokens.keys() - STOPWORDS
+        now = time.time()
+        best_sql, best_score = None, self.similarity_threshold
+        # só entradas que compartilham ao menos um termo podem ter similaridade > 0
+        candidates = set().union(*(self._postings.get(t, ()) for t in tokens))
+        for key in candidates:
+            s_hash, other, other_norm, sql, ts = self._entries[key]
+            if s_hash != schema_hash or now - ts > self.ttl or other.keys() - STOPWORDS != content:
+                continue
+            score = sum(v * other[t] for t, v in tokens.items()) / (norm * other_norm)
+            if score >= best_score:
+                best_sql, best_score = sql, score
+        return best_sql
+
+    def seed(self, nl_query: str, schema_hash: str, sql: str):
+        """Grava uma tradução conhecida apenas se ainda não estiver no cache"""
+        if self.make_key(nl_query, schema_hash) not in self._entries:
+            self.set(nl_query, schema_hash, sql)
+
+    def delete(self, nl_query: str, schema_hash: str):
+        key = self.make_key(nl_query, schema_hash)
+        with self._lock:
+            self.exact.pop(key, None)
+            entry = self._entries.pop(key, None)
+            if entry:
+                for token in entry[1]:
+                    self._postings[token].discard(key)
+            if self._db is None:
+                return
+            try:
+                with self._db:
+                    self._db.execute("DELETE FROM cache WHERE key = ?", (key,))
+            except Exception as e:
+                print(f"Erro ao salvar cache: {e}")
+
+    def set(self, nl_query: str, schema_hash: str, sql: str):
+        key = self.make_key(nl_query, schema_hash)
+        entry = (sql, schema_hash, _normalize_nl(nl_query), int(time.time()))
+        with self._lock:
+            self._index(key, *entry)
+            if self._db is None:
+                return
+            try:
+                with self._db:
+                    self._db.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?)", (key, *entry))
+            except Exception as e:
+                print(f"Erro ao salvar cache: {e}")
+
+# Tamanho mínimo (caracteres) para guardar um SQL comprimido em memória
+COMPRESS_MIN = 200
+
+class LRUCache:
+    """Cache em memória limitado a maxsize entradas, que expiram após ttl segundos.
+    Com path, as entradas também são gravadas em SQLite e sobrevivem entre execuções."""
+
+    def __init__(self, maxsize=1024, ttl=3600, path=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk = None
+        if path:
+            try:
+                Path(path).parent.mkdir(parents=True, exist_ok=True)
+                self._disk = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+                # WAL: leitores (GUI, CLI) não bloqueiam a gravação de outro processo
+                self._disk.execute("PRAGMA journal_mode=WAL")
+                self._disk.execute("CREATE TABLE IF NOT EXISTS c(k TEXT PRIMARY KEY, sql TEXT, ts REAL)")
+                self._disk.execute("DELETE FROM c WHERE ts < ?", (time.time() - self.ttl,))
+            except Exception as e:
+                print(f"Erro ao abrir cache em disco: {e}")
+                self._disk = None
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                row = self._disk_get(key)
+                if row is None:
+                    return default
+                item = self._data[key] = (self._pack(row[0]), row[1])
+            value, ts = item
+            if time.time() - ts > self.ttl:
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            self._evict()
+            return self._unpack(value)
+
+    def __setitem__(self, key, value):
+        ts = time.time()
+        with self._lock:
+            self._data[key] = (self._pack(value), ts)
+            self._data.move_to_end(key)
+            self._evict()
+            if self._disk is not None:
+                try:
+                    self._disk.execute("INSERT OR REPLACE INTO c VALUES (?, ?, ?)", (key, value, ts))
+                except Exception as e:
+                    print(f"Erro ao salvar cache: {e}")
+
+    def __len__(self):
+        return len(self._data)
+
+    @staticmethod
+    def _pack(value):
+        # SQL longo ocupa bem menos comprimido; abaixo de COMPRESS_MIN a compressão não compensa
+        if isinstance(value, str) and len(value) >= COMPRESS_MIN:
+            return zlib.compress(value.encode(), 6)
+        return value
+
+    @staticmethod
+    def _unpack(value):
+        return zlib.decompress(value).decode() if isinstance(value, bytes) else value
+
+    def _disk_get(self, key):
+        if self._disk is None:
+            return None
+        try:
+            return self._disk.execute("SELECT sql, ts FROM c WHERE k = ?", (key,)).fetchone()
+        except Exception:
+            return None
+
+    def _evict(self):
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
 class Text2SQLConverter:
     """Text-to-SQL converter usando Google Gemini"""
 
-    def __init__(self, gemini_api_key=None, current_db=None):
+    def __init__(self, gemini_api_key=None, current_db=None, persist_cache=True):
         self.gemini_api_key = gemini_api_key or os.getenv('GEMINI_API_KEY')
         self.current_db = current_db or DEFAULT_DB_CONFIG['database']
-        self.query_cache = {}
-        self.query_count = 0
-        self.start_time = time.time()
+        self.query_cache = LRUCache(
+            maxsize=int(os.getenv('CACHE_MAX', 1024)),
+            ttl=int(os.getenv('CACHE_TTL', 86400)),
+            # a interface já persiste as traduções no SQLCache; aí o cache do conversor fica só em memória
+            path=os.getenv('T2S_CACHE_DB', str(CACHE_DIR / 't2s_cache.db')) if persist_cache else None
+        )
+        self.stats = {'hits': 0, 'misses': 0, 'templates': 0}
+        # token bucket: até 50 requisições em rajada, reabastecido a 50 por minuto
+        self.capacity = 50
+        self.rate = 50 / 60
+        self.tokens = self.capacity
+        self.last_refill = time.monotonic()
+        self._rate_lock = threading.Lock()
+        self.schema_prompt = None
+        self._schema_prompts = {}
+        self._schema_fingerprints = {}
+        self.cached_content = None
+        self._cached_model = None
+        self._cached_schema_key = None
+        self._context_failed_key = None
+        # criação/remoção do context cache vêm de threads diferentes: uma de cada vez
+        self._context_lock = threading.RLock()
+        self.gemini_model_name = 'gemini-2.0-flash-lite'
         
         if self.gemini_api_key and self.gemini_api_key != 'your_api_key_here':
             try:
                 genai.configure(api_key=self.gemini_api_key)
-                self.gemini_model = genai.GenerativeModel('gemini-2.0-flash-lite')
+                self.gemini_model = genai.GenerativeModel(self.gemini_model_name)
                 print("Google Gemini ativado!")
                 self.use_gemini = True
             except Exception as e:
@@ -46,140 +456,333 @@ class Text2SQLConverter:
             print("⚠️ API key não configurada")
             self.use_gemini = False
 
-    def nl_to_sql(self, nl_query: str, schema: dict) -> str:
+    def warmup(self):
+        """Geração de 1 token para abrir conexão e autenticar antes da primeira pergunta"""
+        if not self.use_gemini:
+            return
+        try:
+            self.gemini_model.generate_content(
+                'ping',
+                generation_config=genai.types.GenerationConfig(max_output_tokens=1)
+            )
+        except Exception as e:
+            print(f"Aquecimento Gemini falhou: {e}")
+
+    def nl_to_sql(self, nl_query: str, schema: dict, schema_prompt: str = None) -> str:
+        if not self.use_gemini:
+            raise Exception("Google Gemini não está configurado. Configure sua API key no arquivo .env")
+
+        cache_key, sql = self._lookup(nl_query, schema)
+        if sql is not None:
+            return sql
+
+        wait = self._rate_limit_wait()
+        if wait:
+            time.sleep(wait)
+
+        sql = self._gemini_generate_sql(nl_query, schema, schema_prompt)
+        return self._accept_sql(cache_key, sql)
+
+    async def anl_to_sql(self, nl_query: str, schema: dict, schema_prompt: str = None) -> str:
+        """Versão assíncrona de nl_to_sql: várias perguntas aguardam o Gemini ao mesmo tempo"""
         if not self.use_gemini:
             raise Exception("Google Gemini não está configurado. Configure sua API key no arquivo .env")
 
-        cache_key = hashlib.md5(f"{nl_query}_{str(sorted(schema.items()))}".encode()).hexdigest()
-        if cache_key in self.query_cache:
-            print("Cache hit!")
-            return self.query_cache[cache_key]
+        cache_key, sql = self._lookup(nl_query, schema)
+        if sql is not None:
+            return sql
+
+        wait = self._rate_limit_wait()
+        if wait:
+            await asyncio.sleep(wait)
+
+        sql = await self._agemini_generate_sql(nl_query, schema, schema_prompt)
+        return self._accept_sql(cache_key, sql)
+
+    async def nl_to_sql_many(self, queries: list, schema: dict, concurrency: int = 8,
+                             schema_prompt: str = None) -> list:
+        """Traduz várias perguntas em paralelo, no máximo `concurrency` chamadas ao Gemini ao mesmo tempo.
+        Perguntas que falharem voltam como a exceção correspondente, na mesma posição."""
+        sem = asyncio.Semaphore(concurrency)
+
+        async def one(nl_query):
+            async with sem:
+                return await self.anl_to_sql(nl_query, schema, schema_prompt)
 
-        elapsed = time.time() - self.start_time
-        if self.query_count >= 50 and elapsed < 60:
-            time.sleep(60 - elapsed)
-            self.start_time = time.time()
-            self.query_count = 0
+        return await asyncio.gather(*(one(q) for q in queries), return_exceptions=True)
+
+    def _lookup(self, nl_query: str, schema: dict):
+        """Cache e templates; devolve (cache_key, sql), com sql None quando é preciso o Gemini"""
+        cache_key = self._query_key(nl_query, schema)
+        sql = self._cached_sql(cache_key)
+        if sql is None:
+            sql = self._template_sql(nl_query, schema)
+            if sql is not None:
+                self.stats['templates'] += 1
+                self.query_cache[cache_key] = sql
+        return cache_key, sql
+
+    def _template_sql(self, nl_query: str, schema: dict):
+        """SQL direto para perguntas triviais conhecidas; None quando é preciso o Gemini"""
+        if self.current_db != 'projeto_final':
+            return None
+        normalized = _normalize_nl(nl_query)
+        for pattern, columns, build in SQL_TEMPLATES:
+            m = pattern.fullmatch(normalized)
+            if m:
+                sql = build(m)
+                if not set(TABLE_REF_RE.findall(sql)) <= set(schema):
+                    return None
+                if any(not set(cols) <= set(schema[table]) for table, cols in columns.items()):
+                    return None
+                return sql
+        return None
+
+    def _cached_sql(self, cache_key: str):
+        sql = self.query_cache.get(cache_key)
+        if sql is None:
+            self.stats['misses'] += 1
+            return None
+        self.stats['hits'] += 1
+        print("Cache hit!")
+        return sql
 
-        sql = self._gemini_generate_sql(nl_query, schema)
-        self.query_count += 1
+    def _query_key(self, nl_query: str, schema: dict) -> str:
+        # o schema já está resumido em 8 bytes: por pergunta só o texto é hasheado
+        return hashlib.blake2b(nl_query.encode() + self._schema_digest(schema), digest_size=16).hexdigest()
 
+    def _rate_limit_wait(self) -> float:
+        """Conta a requisição e devolve quantos segundos esperar para respeitar o limite do Gemini"""
+        with self._rate_lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+            self.last_refill = now
+            # saldo negativo reserva a vez de quem já está esperando (chamadas de threads paralelas)
+            self.tokens -= 1
+            return -self.tokens / self.rate if self.tokens < 0 else 0
+
+    def _accept_sql(self, cache_key: str, sql: str) -> str:
         if self._is_valid_sql(sql):
             self.query_cache[cache_key] = sql
             return sql
         else:
             raise Exception("SQL gerado não passou na validação")
 
-    def _gemini_generate_sql(self, nl_query: str, schema: dict) -> str:
+    def nl_to_sql_batch(self, queries: list, schema: dict, schema_prompt: str = None) -> list:
+        """Traduz várias perguntas numa única chamada ao Gemini; retorna um SQL por pergunta"""
+        if not self.use_gemini:
+            raise Exception("Google Gemini não está configurado. Configure sua API key no arquivo .env")
+
+        lookups = [self._lookup(q, schema) for q in queries]
+        keys = [key for key, _ in lookups]
+        results = [sql for _, sql in lookups]
+        pending = [i for i, sql in enumerate(results) if sql is None]
+
+        parsed = {}
+        if len(pending) > 1:
+            wait = self._rate_limit_wait()
+            if wait:
+                time.sleep(wait)
+            try:
+                parsed = self._gemini_generate_batch([queries[i] for i in pending], schema, schema_prompt)
+            except Exception as e:
+                print(f"Lote falhou, traduzindo uma a uma: {e}")
+
+        for n, i in enumerate(pending, 1):
+            sql = parsed.get(n)
+            if sql and self._is_valid_sql(sql):
+                self.query_cache[keys[i]] = sql
+                results[i] = sql
+                continue
+            # cache e templates já foram consultados acima: vai direto ao Gemini
+            wait = self._rate_limit_wait()
+            if wait:
+                time.sleep(wait)
+            results[i] = self._accept_sql(keys[i], self._gemini_generate_sql(queries[i], schema, schema_prompt))
+        return results
+
+    def _gemini_generate_batch(self, queries: list, schema: dict, schema_prompt: str = None) -> dict:
+        """Envia o prefixo uma vez com N perguntas numeradas; devolve {número: SQL}"""
+        questions = "PERGUNTAS:\n" + "".join(
+            f"{n}. {self._map_departments(q)}\n" for n, q in enumerate(queries, 1)
+        )
+        # a regra de formatação do prompt (quebras de linha entre cláusulas) continua valendo:
+        # cada resposta vai do seu número até o primeiro ';'
+        questions += ("\nResponda cada pergunta, na ordem, no formato \"N: SQL;\" (N é o número da pergunta). "
+                      "Cada SQL termina em ';' antes do número seguinte; não escreva explicações.")
+        model, contents = self._generation_request(questions, schema, schema_prompt)
+        response = model.generate_content(
+            contents, generation_config=self._generation_config(300 * len(queries))
+        )
+        return self._split_batch(response.text)
+
+    def _split_batch(self, text: str) -> dict:
+        """Separa a resposta do lote em {número: SQL}, cada bloco limpo como uma resposta avulsa"""
+        # só vale como início de resposta o próximo número esperado: "1." dentro do SQL não corta o bloco
+        marks = []
+        for m in BATCH_ITEM_RE.finditer(text):
+            if int(m.group(1)) == len(marks) + 1:
+                marks.append(m)
+        parsed = {}
+        for n, m in enumerate(marks, 1):
+            block = text[m.end():marks[n].start() if n < len(marks) else len(text)]
+            if statement_end(block) >= 0:
+                parsed[n] = self._parse_response(self._first_statement(block))
+        return parsed
+
+    def _generation_request(self, question: str, schema: dict, schema_prompt: str = None):
+        """Escolhe o modelo (com ou sem context cache) e o conteúdo a enviar"""
+        # leitura única do modelo em cache: o context cache pode ser recriado em outra thread
+        cached_model = self._cached_model
+        if cached_model is not None and self._cached_schema_key == self._schema_key(schema):
+            return cached_model, [question]
+        return self.gemini_model, (schema_prompt or self.prepare_schema(schema)) + question
+
+    def _generation_config(self, max_output_tokens: int = 300):
+        return genai.types.GenerationConfig(
+            temperature=0.1,
+            max_output_tokens=max_output_tokens,
+            top_p=0.8,
+            top_k=40
+        )
+
+    def _gemini_generate_sql(self, nl_query: str, schema: dict, schema_prompt: str = None) -> str:
         """Geração SQL com Gemini, usando apenas schema quando não for projeto_final"""
+        model, contents = self._generation_request(self._build_question(nl_query), schema, schema_prompt)
+        response = model.generate_content(contents, generation_config=self._generation_config(), stream=True)
+        buf = []
+        for chunk in response:
+            if self._collect(buf, chunk.text):
+                break
+        return self._parse_response(self._first_statement(''.join(buf)))
+
+    async def _agemini_generate_sql(self, nl_query: str, schema: dict, schema_prompt: str = None) -> str:
+        model, contents = self._generation_request(self._build_question(nl_query), schema, schema_prompt)
+        response = await model.generate_content_async(
+            contents, generation_config=self._generation_config(), stream=True
+        )
+        buf = []
+        async for chunk in response:
+            if self._collect(buf, chunk.text):
+                break
+        return self._parse_response(self._first_statement(''.join(buf)))
+
+    @staticmethod
+    def _collect(buf: list, text: str) -> bool:
+        """Acumula um pedaço do stream; True quando o SQL já terminou e o resto pode ser ignorado"""
+        buf.append(text)
+        # o SQL termina no primeiro ';' fora de aspas e comentários: não espera o restante da resposta
+        return ';' in text and statement_end(''.join(buf)) >= 0
+
+    def _first_statement(self, text: str) -> str:
+        end = statement_end(text)
+        return text if end < 0 else text[:end + 1]
+
+    def _parse_response(self, text: str) -> str:
+        sql = self._clean_sql_response(text.strip())
+        return self._fix_quotes(sql)
+
+    def _build_prompt_prefix(self, schema: dict) -> str:
+        """Parte fixa do prompt (instruções + schema), reutilizável entre perguntas"""
         schema_text = self._format_enhanced_schema(schema)
 
         if self.current_db != 'projeto_final':
-            prompt = f"""
-            Você é um DBA especialista em PostgreSQL. Abaixo há o esquema completo do banco, com tabelas e colunas.  
-            Converta a pergunta em linguagem natural para **uma única** consulta SQL válida, formatada com convenções rígidas:
+            return DBA_PROMPT_TEMPLATE.format_map({'schema_text': schema_text})
+        return PROJETO_FINAL_PROMPT_TEMPLATE.format_map({
+            'schema_text': schema_text,
+            'examples': self._get_query_examples(),
+        })
 
-            • **Palavras-chave em MAIÚSCULAS**: SELECT, FROM, WHERE, JOIN, ON, GROUP BY, ORDER BY, LIMIT, etc.  
-            • **Espaço** antes e depois de cada palavra-chave.  
-            • **Quebras de linha** entre as principais cláusulas:  
-                SELECT …  
-                FROM …  
-                [JOIN … ON …]  
-                WHERE …  
-                [GROUP BY …]  
-                [ORDER BY …]  
-            • **Indentação** de 2 espaços em JOIN/ON.  
-            • Termine sempre com ponto-e-vírgula `;`  
-            • Não inclua nada além da consulta (sem explicações, sem markdown, sem comentários).
+    def prepare_schema(self, schema: dict) -> str:
+        """Serializa o schema no prefixo do prompt uma vez por versão do schema"""
+        key = self._schema_key(schema)
+        if key not in self._schema_prompts:
+            self._schema_prompts[key] = self._build_prompt_prefix(schema)
+        self.schema_prompt = self._schema_prompts[key]
+        return self.schema_prompt
 
-            ESQUEMA DO BANCO:
-            {schema_text}
+    def decompose(self, nl_query: str) -> list:
+        """Divide perguntas compostas ("... e também ...") em sub-perguntas independentes"""
+        parts = [p.strip(' ?.,') for p in COMPOUND_SPLIT_RE.split(nl_query)]
+        parts = [p for p in parts if len(p.split()) >= 2]
+        if len(parts) < 2 or not all(STANDALONE_RE.match(p) for p in parts):
+            return [nl_query]
+        return parts
 
-            PERGUNTA: {nl_query}
-            """
-        else:
-            examples = self._get_query_examples()
-            prompt = (
-                f"Você é um especialista em SQL PostgreSQL. Converta esta pergunta em linguagem natural para uma consulta SQL válida e completa.\n\n"
-                f"ESQUEMA DETALHADO DO BANCO DE DADOS:\n{schema_text}\n\n"
-                "MAPEAMENTOS DE DEPARTAMENTOS (IMPORTANTE):\n"
-                "- \"Economia\" ou \"Economics\" → \"Finance\"\n"
-                "- \"Ciência da Computação\" ou \"Computer Science\" → \"Comp. Sci.\"\n"
-                "- \"Física\" ou \"Physics\" → \"Physics\"\n"
-                "- \"Matemática\" ou \"Mathematics\" → \"Math\"\n\n"
-                f"EXEMPLOS DE CONSULTAS VÁLIDAS:\n{examples}\n"
-                "REGRAS OBRIGATÓRIAS:\n"
-                "1. SEMPRE inclua as cláusulas SELECT e FROM\n"
-                "2. Use JOINs quando necessário para conectar tabelas relacionadas\n"
-                "3. Para médias de notas: AVG(takes.grade) com JOIN entre takes e course\n"
-                "4. Para filtrar por departamento: WHERE course.dept_name = 'Nome_Dept'\n"
-                "5. Para filtrar por ano: WHERE takes.year = XXXX\n"
-                "6. Use aspas simples para strings: 'Finance', nunca \"Finance\"\n"
-                "7. Termine sempre com ponto e vírgula\n"
-                "8. Para contagens: COUNT(*) ou COUNT(DISTINCT coluna)\n"
-                "9. Para ordenação: ORDER BY coluna DESC/ASC quando apropriado\n"
-                "10. NUNCA retorne SQL incompleto ou fragmentado\n\n"
-                f"PERGUNTA: {nl_query}\n\n"
-                f"Gere apenas o SQL completo e válido (sem explicações, markdown ou comentários):"
-            )
+    def _build_question(self, nl_query: str) -> str:
+        template = PROJETO_FINAL_QUESTION_TEMPLATE if self.current_db == 'projeto_final' else QUESTION_TEMPLATE
+        return template.format_map({'nl_query': self._map_departments(nl_query)})
 
-        response = self.gemini_model.generate_content(
-            prompt,
-            generation_config=genai.types.GenerationConfig(
-                temperature=0.1,
-                max_output_tokens=300,
-                top_p=0.8,
-                top_k=40
-            )
-        )
-        sql = response.text.strip()
-        sql = self._clean_sql_response(sql)
-        return self._fix_quotes(sql)
+    def _map_departments(self, nl_query: str) -> str:
+        # o mapeamento vale só para os departamentos do banco projeto_final
+        if self.current_db != 'projeto_final':
+            return nl_query
+        return DEPT_RE.sub(lambda m: DEPT_MAP[m.group(0).lower()], nl_query)
+
+    def _schema_key(self, schema: dict) -> str:
+        """Fingerprint do schema, calculado uma vez por objeto schema"""
+        return self._schema_entry(schema)[1]
+
+    def _schema_digest(self, schema: dict) -> bytes:
+        return self._schema_entry(schema)[2]
+
+    def _schema_entry(self, schema: dict):
+        entry = self._schema_fingerprints.get(id(schema))
+        # guarda o próprio dict junto: impede que o id seja reaproveitado por outro objeto
+        if entry is None or entry[0] is not schema:
+            if len(self._schema_fingerprints) >= 8:
+                self._schema_fingerprints.clear()
+            digest = schema_digest(schema)
+            entry = (schema, digest.hex(), digest)
+            self._schema_fingerprints[id(schema)] = entry
+        return entry
+
+    def create_context_cache(self, schema: dict, ttl: int = 3600):
+        """Envia o prefixo do prompt (instruções + schema) uma única vez via context caching do Gemini"""
+        if not self.use_gemini:
+            return
+        key = self._schema_key(schema)
+        with self._context_lock:
+            # já em cache (ou já recusado pela API) para este schema: nada a fazer
+            if key in (self._cached_schema_key, self._context_failed_key):
+                return
+            self.clear_context_cache()
+            try:
+                cached_content = genai.caching.CachedContent.create(
+                    # mesmo modelo das gerações sem cache, para as respostas não mudarem de modelo
+                    model=f"models/{self.gemini_model_name}",
+                    contents=[self.prepare_schema(schema)],
+                    ttl=datetime.timedelta(seconds=ttl)
+                )
+                self.cached_content = cached_content
+                self._cached_schema_key = key
+                # atribuído por último: é o que _gemini_generate_sql usa para decidir pelo cache
+                self._cached_model = genai.GenerativeModel.from_cached_content(cached_content=cached_content)
+            except Exception as e:
+                # Schemas pequenos não atingem o mínimo de tokens do cache; segue com o prompt completo
+                self._context_failed_key = key
+                print(f"Context cache indisponível: {e}")
+
+    def clear_context_cache(self):
+        with self._context_lock:
+            self._cached_model = None
+            self._cached_schema_key = None
+            if self.cached_content is not None:
+                try:
+                    self.cached_content.delete()
+                except Exception:
+                    pass
+            self.cached_content = None
 
     def _format_enhanced_schema(self, schema: dict) -> str:
-        descriptions = {
-            'student': ('Informações dos estudantes da universidade', [
-                'id (INTEGER, PRIMARY KEY)',
-                'name (VARCHAR)',
-                'dept_name (VARCHAR)',
-                'tot_cred (INTEGER)' ],
-                'Relaciona com department(dept_name), takes(id)'),
-            'instructor': ('Informações dos professores', [
-                'id (INTEGER, PRIMARY KEY)',
-                'name (VARCHAR)',
-                'dept_name (VARCHAR)',
-                'salary (NUMERIC)' ],
-                'Relaciona com department(dept_name)'),
-            'course': ('Catálogo de cursos ofertados', [
-                'course_id (VARCHAR, PRIMARY KEY)',
-                'title (VARCHAR)',
-                'dept_name (VARCHAR)',
-                'credits (INTEGER)' ],
-                'Relaciona com department(dept_name), takes(course_id)'),
-            'takes': ('Registro de matrículas e notas', [
-                'id (INTEGER)',
-                'course_id (VARCHAR)',
-                'sec_id (INTEGER)',
-                'semester (VARCHAR)',
-                'year (INTEGER)',
-                'grade (NUMERIC)' ],
-                'Relaciona student(id), course(course_id)'),
-            'department': ('Departamentos da universidade', [
-                'dept_name (VARCHAR, PRIMARY KEY)',
-                'building (VARCHAR)',
-                'budget (NUMERIC)' ],
-                'Relaciona student, instructor, course')
-        }
-        text = ''
-        for table, cols in schema.items():
-            if table in descriptions:
-                desc, columns, rel = descriptions[table]
-                text += f"TABELA {table}: {desc}\n"
-                text += "Colunas:\n"
-                for col in columns:
-                    text += f"  - {col}\n"
-                text += f"Relacionamentos: {rel}\n\n"
-        return text
+        parts = []
+        for table in schema:
+            if table in TABLE_DESCRIPTIONS:
+                desc, columns, rel = TABLE_DESCRIPTIONS[table]
+                parts.append(f"TABELA {table}: {desc}\nColunas:\n")
+                parts.extend(f"  - {col}\n" for col in columns)
+                parts.append(f"Relacionamentos: {rel}\n\n")
+        return ''.join(parts)
 
     def _get_query_examples(self) -> str:
         return (
@@ -190,46 +793,119 @@ class Text2SQLConverter:
         )
 
     def _clean_sql_response(self, sql: str) -> str:
-        if sql.startswith('```'):
-            sql = ''.join(line for line in sql.splitlines() if not line.startswith('```'))
-        lines = []
-        for l in sql.splitlines():
-            l = l.strip()
-            if l and not l.startswith('--') and not l.startswith('#'):
-                lines.append(l)
-        sql = ' '.join(lines)
+        sql = STRIP_RE.sub('', sql)
+        sql = WHITESPACE_RE.sub(' ', sql).strip()
         return sql.rstrip(';') + ';'
 
     def _is_valid_sql(self, text: str) -> bool:
-        t = text.upper().strip()
-        return ('SELECT' in t and 'FROM' in t and text.strip().endswith(';')
-                and t.find('SELECT') < t.find('FROM')
-                and 10 < len(text) < 2000)
+        t = text.strip()
+        return 10 < len(t) < 2000 and VALID_SQL_RE.match(t) is not None
 
     def _fix_quotes(self, sql: str) -> str:
-        sql = re.sub(r'"([^"]+)"', r"'\1'", sql)
-        return sql
+        return DOUBLE_QUOTED_RE.sub(r"'\1'", sql)
 
 # Conexão com o banco
 def connect_db(**overrides):
     cfg = {**DEFAULT_DB_CONFIG, **overrides}
     url = (f"postgresql+psycopg2://{cfg['user']}:{cfg['password']}@"
            f"{cfg['host']}:{cfg['port']}/{cfg['database']}")
-    return sqlalchemy.create_engine(url)
+    # conexões reaproveitadas entre consultas; pre_ping/recycle evitam conexões mortas
+    return sqlalchemy.create_engine(url, poolclass=QueuePool, pool_size=4, max_overflow=8,
+                                    pool_pre_ping=True, pool_recycle=1800)
 
 # Funções auxiliares
 def get_schema(engine):
-    insp = sqlalchemy.inspect(engine)
-    sch = {}
-    for t in insp.get_table_names():
-        sch[t] = [c['name'] for c in insp.get_columns(t)]
-    return sch
+    """Retorna (schema, schema_details): colunas por tabela e pares (coluna, tipo) para exibição"""
+    # uma única ida ao catálogo em vez de uma chamada get_columns por tabela
+    with engine.connect() as conn:
+        rows = conn.execute(sqlalchemy.text(
+            "SELECT c.table_name, c.column_name, upper(c.data_type) "
+            "FROM information_schema.columns c "
+            "JOIN information_schema.tables t "
+            "  ON t.table_schema = c.table_schema AND t.table_name = c.table_name "
+            "WHERE c.table_schema = 'public' AND t.table_type = 'BASE TABLE' "
+            "ORDER BY c.table_name, c.ordinal_position"
+        )).fetchall()
+    sch = defaultdict(list)
+    details = defaultdict(list)
+    for table, column, data_type in rows:
+        sch[table].append(column)
+        details[table].append((column, data_type))
+    return dict(sch), dict(details)
+
+def _schema_cache_path(engine) -> Path:
+    url_hash = hashlib.blake2b(engine.url.render_as_string().encode(), digest_size=16).hexdigest()
+    return CACHE_DIR / f"schema-{url_hash}.pkl"
+
+def schema_fingerprint(engine) -> str:
+    """Impressão digital do schema em uma única consulta ao catálogo"""
+    with engine.connect() as conn:
+        return conn.execute(sqlalchemy.text(
+            "SELECT md5(coalesce(string_agg(table_name || '.' || column_name || ':' || data_type, ',' "
+            "ORDER BY table_name, ordinal_position), '')) "
+            "FROM information_schema.columns WHERE table_schema = 'public'"
+        )).scalar()
+
+def load_cached_schema(engine):
+    """Retorna (fingerprint, schema, schema_details) salvos em disco, ou None"""
+    try:
+        with open(_schema_cache_path(engine), 'rb') as f:
+            data = pickle.load(f)
+        return data['fingerprint'], data['schema'], data['details']
+    except Exception:
+        return None
+
+def save_cached_schema(engine, fingerprint, schema, details):
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        with open(_schema_cache_path(engine), 'wb') as f:
+            pickle.dump({'fingerprint': fingerprint, 'schema': schema, 'details': details}, f)
+    except Exception as e:
+        print(f"Erro ao salvar cache do schema: {e}")
 
 def execute_query(engine, query):
     with engine.connect() as conn:
         res = conn.execute(sqlalchemy.text(query))
         return res.keys(), res.fetchall()
 
+def execute_queries(engine, queries):
+    """Executa várias consultas numa única conexão, gerando (colunas, linhas) para cada uma"""
+    # AUTOCOMMIT: só leituras, sem BEGIN/COMMIT por consulta
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        for query in queries:
+            res = conn.execute(sqlalchemy.text(query))
+            yield res.keys(), res.fetchall()
+
+def execute_query_chunks(engine, query, chunksize=1000, readonly=False):
+    """Executa a query com cursor nomeado (server-side) do psycopg2, produzindo (colunas, lote) a cada fetchmany.
+    Com readonly, a sessão fica somente leitura: o banco recusa qualquer escrita."""
+    conn = engine.raw_connection()
+    try:
+        if readonly:
+            conn.rollback()
+            conn.set_session(readonly=True)
+        cur = conn.cursor(name=f"stream_{uuid.uuid4().hex}")
+        cur.itersize = chunksize
+        cur.execute(query)
+        # em cursores nomeados a descrição só existe após o primeiro fetch
+        chunk = cur.fetchmany(chunksize)
+        columns = [d.name for d in cur.description]
+        yield columns, chunk
+        while chunk:
+            chunk = cur.fetchmany(chunksize)
+            if chunk:
+                yield columns, chunk
+        cur.close()
+    finally:
+        if readonly:
+            try:
+                # a conexão volta ao pool: desfaz o modo somente leitura
+                conn.rollback()
+                conn.set_session(readonly=False)
+            except Exception:
+                pass
+        conn.close()
+
 # CLI e execução principal
 
 def parse_args():
@@ -251,8 +927,14 @@ if __name__ == '__main__':
         database=args.database
     )
     converter = Text2SQLConverter(current_db=args.database)
-    schema = get_schema(engine)
+    schema, _ = get_schema(engine)
     nl = "qual a média de notas de Economia em 2024?"
     sql = converter.nl_to_sql(nl, schema)
-    cols, rows = execute_query(engine, sql)
-    print(cols, rows)
+    # resultados lidos por cursor no servidor: memória constante mesmo para consultas grandes
+    header_printed = False
+    for cols, chunk in execute_query_chunks(engine, sql):
+        if not header_printed:
+            print(cols)
+            header_printed = True
+        for row in chunk:
+            print(row)